@@ -6,31 +6,49 @@ from __future__ import annotations
 import logging
 import os
 import re
+import shlex
 import subprocess
 import time
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
-
-import xmltodict
+from xml.etree import ElementTree
 
 # pylint: disable=no-name-in-module
+from pylibsshext.errors import LibsshException
 from pylibsshext.errors import LibsshSessionException
-from pylibsshext.session import Channel
 from pylibsshext.session import Session
 
 from .exceptions import PytestNetworkError
+from .utils import _IN_GITHUB_ACTIONS
 
 
 # pylint: enable=no-name-in-module
 
 logger = logging.getLogger(__name__)
 
+# Example output: Starting lab xxx (ID: 9fde5f)\n
+_CML_ID_RE = re.compile(r"ID: (?P<id>[^)]+)\)")
+# [ \t] rather than \s: in MULTILINE mode \s would also match the newline
+# and let an ID at column 0 of the next line slip through
+_VIRSH_ID_RE = re.compile(r"^[ \t](\d+)", re.MULTILINE)
+
+
+def _backoff_sleep(delay: float, cap: float = 5.0) -> float:
+    """Sleep for the given delay and return the next backoff delay.
+
+    :param delay: The current delay in seconds.
+    :param cap: The maximum delay in seconds.
+    :return: The next delay, doubled up to the cap.
+    """
+    time.sleep(delay)
+    return min(delay * 2, cap)
+
 
 @dataclass
 class AnsibleProject:
@@ -48,6 +66,8 @@ class AnsibleProject:
 class SshWrapper:
     """Wrapper for pylibssh to manage SSH connections and execute commands in remote devices."""
 
+    __slots__ = ("host", "password", "port", "session", "user")
+
     def __init__(self, host: str, user: str, password: str, port: int = 22):
         """Initialize the SSH wrapper.
 
@@ -60,7 +80,6 @@ class SshWrapper:
         self.password = password
         self.port = port
         self.session = Session()
-        self.ssh_channel: Channel
         self.user = user
 
     def connect(self) -> None:
@@ -84,39 +103,64 @@ class SshWrapper:
         except LibsshSessionException as exc:
             logger.error("Failed to connect to %s", self.host)
             raise exc
-        self.ssh_channel = self.session.new_channel()
 
     def execute(self, command: str) -> Tuple[str, str]:
         """Execute a command on the SSH server.
 
-        Executes the specified command on the connected SSH server and returns
-        the standard output and standard error.
+        Executes the specified command on a fresh channel over the existing
+        session and returns the standard output and standard error. Only the
+        channel is rebuilt per command; the session (and its TCP+auth
+        handshake) is reused. A session the server dropped is reconnected
+        before the channel is opened, and any libssh failure during the
+        command triggers one reconnect and retry.
+
+        :param command: The command to execute.
+        :raises LibsshException: If the command fails after a reconnect.
+        :return: A tuple containing the standard output and standard error.
+        """
+        try:
+            return self._exec(command)
+        except LibsshException:
+            # Covers both session and channel errors; the two are sibling
+            # subclasses and a mid-command drop surfaces as either
+            logger.warning("SSH command failed. Reconnecting...")
+            self.connect()
+            try:
+                return self._exec(command)
+            except LibsshException as exc:
+                logger.error("Failed to execute command: %s", command)
+                raise exc
+
+    def _exec(self, command: str) -> Tuple[str, str]:
+        """Execute a command on a fresh channel over the current session.
 
         :param command: The command to execute.
-        :raises LibsshSessionException: If the channel fails.
         :return: A tuple containing the standard output and standard error.
         """
         if not self.session.is_connected:
+            # new_channel on a dead session does not raise a libssh error,
+            # so a dropped session has to be caught here
             logger.warning("Session is not connected. Reconnecting...")
-            self.close()
             self.connect()
+        ssh_channel = self.session.new_channel()
         try:
             logger.debug("Executing command: %s", command)
-            result = self.ssh_channel.exec_command(command)
-            stdout = result.stdout.decode()
-            stderr = result.stderr.decode()
+            result = ssh_channel.exec_command(command)
+            # Skip the UTF-8 pass for the common empty-stream case
+            stdout = result.stdout.decode() if result.stdout else ""
+            stderr = result.stderr.decode() if result.stderr else ""
             return stdout, stderr
-        except LibsshSessionException as exc:
-            logger.error("Failed to execute command: %s", command)
-            raise exc
+        finally:
+            ssh_channel.close()
 
     def close(self) -> None:
-        """Close the SSH channel.
+        """Close the SSH session.
 
-        Closes the SSH channel to the server.
+        Closes the SSH session to the server.
         """
-        logger.debug("Closing SSH channel")
-        self.ssh_channel.close()
+        logger.debug("Closing SSH session")
+        if self.session.is_connected:
+            self.session.close()
 
 
 class CmlWrapper:
@@ -125,6 +169,8 @@ class CmlWrapper:
     This class essentially interacts with the library cmlutils.
     """
 
+    __slots__ = ("current_lab_id", "_env", "_host", "_lab_existed")
+
     def __init__(self, host: str, username: str, password: str) -> None:
         """
         Initialize the CmlWrapper.
@@ -133,14 +179,21 @@ class CmlWrapper:
         :param username: The username for authentication.
         :param password: The password for authentication.
         """
-        self.current_lab_id: str
+        self.current_lab_id: str = ""
         self._host = host
-        self._auth_env = {
-            "VIRL_HOST": host,
-            "VIRL_USERNAME": username,
-            "VIRL_PASSWORD": password,
-            "CML_VERIFY_CERT": "False",
-        }
+        self._env = os.environ.copy()
+        if "VIRTUAL_ENV" in os.environ:
+            self._env["PATH"] = (
+                os.path.join(os.environ["VIRTUAL_ENV"], "bin") + os.pathsep + self._env["PATH"]
+            )
+        self._env.update(
+            {
+                "VIRL_HOST": host,
+                "VIRL_USERNAME": username,
+                "VIRL_PASSWORD": password,
+                "CML_VERIFY_CERT": "False",
+            }
+        )
         self._lab_existed: bool = False
 
     def bring_up(self, file: str) -> None:
@@ -153,12 +206,18 @@ class CmlWrapper:
         :param file: The file to bring up the lab.
         :raises PytestNetworkError: If the lab fails to start.
         """
+        if self.current_lab_id:
+            # A previous call in this process already found or started the
+            # lab, no need to fork a cml probe to rediscover it
+            logger.info("Using known lab id '%s'", self.current_lab_id)
+            return
+
         logger.info("Checking if lab is already provisioned")
         stdout, _stderr = self._run("id")
         if stdout:
-            current_lab_match = re.match(r".*ID: (?P<id>\S+)\)\n", stdout, re.DOTALL)
+            current_lab_match = _CML_ID_RE.search(stdout)
             if current_lab_match:
-                self.current_lab_id = current_lab_match.groupdict()["id"]
+                self.current_lab_id = current_lab_match.group("id")
                 logger.info("Using existing lab id '%s'", self.current_lab_id)
                 self._lab_existed = True
                 return
@@ -171,23 +230,16 @@ class CmlWrapper:
         stdout, stderr = self._run(f"up -f {file}")
         logger.debug("CML up stdout: '%s'", stdout)
 
-        # Example output: Starting lab xxx (ID: 9fde5f)\n
-        current_lab_match = re.match(r".*ID: (?P<id>\S+)\)\n", stdout, re.DOTALL)
+        current_lab_match = _CML_ID_RE.search(stdout)
         if not current_lab_match:
             logger.error("Failed to bring up the or match the lab ID")
             logger.error("CML up stderr: %s", stderr)
             raise PytestNetworkError(f"Could not get lab ID: {stdout} {stderr}")
 
-        try:
-            self.current_lab_id = current_lab_match.groupdict()["id"]
-        except KeyError as e:
-            error_message = f"Failed to extract lab ID: {e}"
-            logger.error(error_message)
-            raise PytestNetworkError(error_message) from e
-
+        self.current_lab_id = current_lab_match.group("id")
         logger.info("Started lab id '%s'", self.current_lab_id)
 
-        if os.environ.get("GITHUB_ACTIONS"):
+        if _IN_GITHUB_ACTIONS:
             # In the case of GH actions store the labs in an env var for clean up if the job is
             # cancelled, this is referenced in the GH integration workflow
             self._update_github_env()
@@ -220,24 +272,19 @@ class CmlWrapper:
         :param command: The command to run.
         :return: A tuple containing stdout and stderr.
         """
-        cml_command = f"cml {command}"
-        logger.info("Running command '%s' on '%s'", cml_command, self._host)
-        env = os.environ.copy()
-        if "VIRTUAL_ENV" in os.environ:
-            env["PATH"] = os.path.join(os.environ["VIRTUAL_ENV"], "bin") + os.pathsep + env["PATH"]
-
-        env.update(self._auth_env)
-
-        logger.debug("Running command '%s' with environment '%s'", cml_command, env)
-        with subprocess.Popen(
+        cml_command = ["cml", *shlex.split(command)]
+        logger.info("Running command '%s' on '%s'", " ".join(cml_command), self._host)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Running command '%s' with environment '%s'", cml_command, self._env)
+        completed = subprocess.run(
             cml_command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=env,
-        ) as process:
-            stdout, stderr = process.communicate()
-        return stdout.decode(), stderr.decode()
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            env=self._env,
+            check=False,
+        )
+        return completed.stdout, completed.stderr
 
     def _update_github_env(self) -> None:
         """Update the GitHub environment file with the current lab ID."""
@@ -249,22 +296,38 @@ class CmlWrapper:
         if not env_file:
             return
 
-        with open(env_file, "r", encoding="utf-8") as fh:
-            data = fh.readlines()
+        lab_entry = self.current_lab_id.encode()
+        needle = b"CML_LABS="
+        with open(env_file, "rb") as fh:
+            data = fh.read()
 
-        line_id = [idx for idx, line in enumerate(data) if line.startswith("CML_LABS=")]
-        if not line_id:
-            data.append(f"CML_LABS={self.current_lab_id}")
+        if data.startswith(needle):
+            start = 0
         else:
-            data[line_id[0]] += f",{self.current_lab_id}"
+            idx = data.find(b"\n" + needle)
+            start = idx + 1 if idx != -1 else -1
+
+        if start == -1:
+            # Common case: no CML_LABS line yet, append without rewriting
+            with open(env_file, "ab") as fh:
+                if data and not data.endswith(b"\n"):
+                    fh.write(b"\n")
+                fh.write(needle + lab_entry + b"\n")
+            return
 
-        with open(env_file, "w", encoding="utf-8") as fh:
-            fh.writelines(data)
+        # Splice the lab ID onto the end of the existing line
+        end = data.find(b"\n", start)
+        if end == -1:
+            end = len(data)
+        with open(env_file, "wb") as fh:
+            fh.write(data[:end] + b"," + lab_entry + data[end:])
 
 
 class VirshWrapper:
     """Wrapper for interacting with virsh via SSH."""
 
+    __slots__ = ("ssh",)
+
     def __init__(self, host: str, user: str, password: str, port: int) -> None:
         """Initialize the VirshWrapper.
 
@@ -285,12 +348,12 @@ class VirshWrapper:
         :return: The IP address associated with the lab.
         """
         logger.info("Getting current lab from virsh")
-        current_lab = self._find_current_lab(current_lab_id, 20)
+        current_lab = self._find_current_lab(current_lab_id, timeout=100)
 
         macs = self._extract_macs(current_lab)
         logger.info("Found MAC addresses: %s", macs)
 
-        ips = self._find_dhcp_lease(macs, 100)
+        ips = self._find_dhcp_lease(macs, timeout=1000)
         logger.debug("Found IPs: %s", ips)
 
         if len(ips) > 1:
@@ -300,109 +363,119 @@ class VirshWrapper:
         logger.info("DHCP lease IP found: %s", ips[0])
         return ips[0]
 
-    def _find_current_lab(self, current_lab_id: str, max_attempts: int = 20) -> Dict[str, Any]:
+    def _find_current_lab(self, current_lab_id: str, timeout: float = 100) -> ElementTree.Element:
         """Find the current lab by its ID.
 
+        Polls with exponential backoff until the lab is found or the
+        deadline is reached.
+
         :param current_lab_id: The current lab ID.
-        :param max_attempts: The maximum number of attempts to find the lab.
+        :param timeout: The maximum number of seconds to poll for the lab.
         :raises PytestNetworkError: If the current lab cannot be found.
-        :return: A dictionary representing the current lab.
+        :return: The domain XML of the current lab.
         """
+        deadline = time.monotonic() + timeout
+        delay = 0.25
         attempt = 0
+        checked: Set[str] = set()
 
-        while attempt < max_attempts:
+        while time.monotonic() < deadline:
             logger.info("Attempt %s to find the current lab", attempt)
             stdout, _stderr = self.ssh.execute("sudo virsh list --all")
-            logger.debug("virsh list output: %s", stdout)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("virsh list output: %s", stdout)
             if _stderr:
                 logger.error("virsh list stderr: %s", _stderr)
 
-            virsh_matches = [re.match(r"^\s(?P<id>\d+)", line) for line in stdout.splitlines()]
-            if not any(virsh_matches):
+            virsh_ids = _VIRSH_ID_RE.findall(stdout)
+            if not virsh_ids:
                 logger.error("No matching virsh IDs found in the output")
                 raise PytestNetworkError("No matching virsh IDs found")
 
-            try:
-                virsh_ids = [
-                    virsh_match.groupdict()["id"] for virsh_match in virsh_matches if virsh_match
-                ]
-            except KeyError as e:
-                error_message = f"Failed to extract virsh IDs: {e}"
-                logger.error(error_message)
-                raise PytestNetworkError(error_message) from e
-
-            for virsh_id in virsh_ids:
-                stdout, _stderr = self.ssh.execute(f"sudo virsh dumpxml {virsh_id}")
+            # A domain's XML never gains the lab ID later, so only dump
+            # domains not seen on a previous attempt, all in one round-trip
+            new_ids = [virsh_id for virsh_id in virsh_ids if virsh_id not in checked]
+            if new_ids:
+                command = "; ".join(f"sudo virsh dumpxml {virsh_id}" for virsh_id in new_ids)
+                stdout, _stderr = self.ssh.execute(command)
+                checked.update(new_ids)
                 if current_lab_id in stdout:
-                    logger.debug("Found lab %s in virsh dumpxml: %s", current_lab_id, stdout)
-                    xmltodict_data = xmltodict.parse(stdout)
-                    return xmltodict_data  # type: ignore
+                    for domain_xml in stdout.split("</domain>"):
+                        if current_lab_id not in domain_xml:
+                            continue
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(
+                                "Found lab %s in virsh dumpxml: %s", current_lab_id, domain_xml
+                            )
+                        try:
+                            return ElementTree.fromstring(domain_xml + "</domain>")
+                        except ElementTree.ParseError as e:
+                            error_message = f"Failed to parse domain XML: {e}"
+                            logger.error(error_message)
+                            raise PytestNetworkError(error_message) from e
 
             attempt += 1
-            time.sleep(5)
+            delay = _backoff_sleep(delay)
 
         logger.error("Could not find current lab after %s attempts", attempt)
         raise PytestNetworkError("Could not find current lab")
 
-    def _extract_macs(self, current_lab: Dict[str, Any]) -> List[str]:
+    def _extract_macs(self, current_lab: ElementTree.Element) -> List[str]:
         """Extract MAC addresses from the current lab.
 
-        :param current_lab: A dictionary representing the current lab.
+        :param current_lab: The domain XML of the current lab.
         :raises PytestNetworkError: If the MAC addresses cannot be extracted.
         :return: A list of MAC addresses.
         """
-        try:
-            macs = [
-                interface["mac"]["@address"]
-                for interface in current_lab["domain"]["devices"]["interface"]
-            ]
-            return macs
-        except KeyError as e:
-            error_message = f"Failed to extract MAC addresses: {e}"
+        macs = [
+            mac.attrib["address"]
+            for mac in current_lab.findall("./devices/interface/mac")
+            if "address" in mac.attrib
+        ]
+        if not macs:
+            error_message = "Failed to extract MAC addresses"
             logger.error(error_message)
-            raise PytestNetworkError(error_message) from e
+            raise PytestNetworkError(error_message)
+        return macs
 
-    def _find_dhcp_lease(self, macs: List[str], max_attempts: int = 100) -> List[str]:
+    def _find_dhcp_lease(self, macs: List[str], timeout: float = 1000) -> List[str]:
         """Find the DHCP lease for the given MAC addresses.
 
+        Polls with exponential backoff until a lease is found or the
+        deadline is reached.
+
         :param macs: A list of MAC addresses.
-        :param max_attempts: The maximum number of attempts to find the DHCP lease.
+        :param timeout: The maximum number of seconds to poll for the lease.
         :raises PytestNetworkError: If the DHCP lease cannot be found.
         :return: A list of IP addresses.
         """
+        deadline = time.monotonic() + timeout
+        delay = 0.25
         attempt = 0
-        ips: List[str] = []
+        mac_set = set(macs)
 
-        while attempt < max_attempts:
+        while time.monotonic() < deadline:
             logger.info("Attempt %s to find DHCP lease", attempt)
             stdout, _stderr = self.ssh.execute("sudo virsh net-dhcp-leases default")
-            logger.debug("virsh net-dhcp-leases output: %s", stdout)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("virsh net-dhcp-leases output: %s", stdout)
             if _stderr:
                 logger.error("virsh net-dhcp-leases stderr: %s", _stderr)
 
-            try:
-                leases = {
-                    p[2]: p[4].split("/")[0]
-                    for p in [line.split() for line in stdout.splitlines()]
-                    if len(p) == 7
-                }
-            except (IndexError, ValueError) as e:
-                error_message = f"Failed to parse DHCP leases: {e}"
-                logger.error(error_message)
-                raise PytestNetworkError(error_message) from e
-
-            try:
-                ips = [leases[mac] for mac in macs if mac in leases]
-            except KeyError as e:
-                error_message = f"Failed to find IP for MAC address: {e}"
-                logger.error(error_message)
-                raise PytestNetworkError(error_message) from e
+            found: Dict[str, str] = {}
+            for line in stdout.splitlines():
+                parts = line.split()
+                if len(parts) == 7 and parts[2] in mac_set:
+                    found[parts[2]] = parts[4].partition("/")[0]
+                    if len(found) == len(mac_set):
+                        break
 
-            if ips:
+            if found:
+                ips = [found[mac] for mac in macs if mac in found]
                 return ips
 
             attempt += 1
-            time.sleep(10)
+            delay = _backoff_sleep(delay, cap=10.0)
 
         logger.error("Could not find IPs after %s attempts", attempt)
         raise PytestNetworkError("Could not find IPs")
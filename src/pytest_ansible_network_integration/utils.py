@@ -1,12 +1,37 @@
 """Utility functions for the Ansible network integration tests plugin."""
 
+import json
 import os
 
+from functools import lru_cache
 from typing import Any
 from typing import Dict
 from typing import List
 
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+# Whether this process runs under GitHub Actions never changes mid-session
+_IN_GITHUB_ACTIONS = bool(os.environ.get("GITHUB_ACTIONS"))
+
+
+def _json_dumps(data: Any) -> bytes:
+    """Serialize data to JSON bytes.
+
+    Uses orjson when it is installed, falling back to the stdlib encoder.
+
+    :param data: The data to serialize
+    :returns: The serialized JSON bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
 def _print(message: str) -> None:
     """Print a message and flush.
 
@@ -22,10 +47,11 @@ def _github_action_log(message: str) -> None:
 
     :param message: The message
     """
-    if os.environ.get("GITHUB_ACTIONS"):
+    if _IN_GITHUB_ACTIONS:
         _print(message)
 
 
+@lru_cache(maxsize=64)
 def _inventory(
     host: str,
     httpapi_port: int,
@@ -37,6 +63,9 @@ def _inventory(
     # pylint: disable=too-many-arguments
     """Build an ansible inventory.
 
+    The result is cached per argument set and must not be mutated by the
+    caller; it is serialized as-is.
+
     :param host: The hostname
     :param httpapi_port: The HTTPAPI port
     :param network_os: The network OS
@@ -67,9 +96,13 @@ def _inventory(
     return inventory
 
 
+@lru_cache(maxsize=64)
 def playbook(hosts: str, role: str) -> List[Dict[str, object]]:
     """Return the playbook.
 
+    The result is cached per argument set and must not be mutated by the
+    caller; it is serialized as-is.
+
     :param hosts: The hosts entry for the playbook
     :param role: The role's path
     :returns: The playbook
@@ -80,20 +113,19 @@ def playbook(hosts: str, role: str) -> List[Dict[str, object]]:
     return playbook_obj
 
 
+_PORT_BASES = (
+    ("ssh_port", 2000),
+    ("https_port", 4000),
+    ("http_port", 8000),
+    ("netconf_port", 3000),
+)
+
+
 def calculate_ports(appliance_dhcp_address: str) -> Dict[str, int]:
     """Calculate ports based on the appliance DHCP address.
 
     :param appliance_dhcp_address: The DHCP address of the appliance.
-    :return: A tuple containing the SSH port, HTTPS port, HTTP port, and NETCONF port.
+    :return: A dictionary of the SSH, HTTPS, HTTP, and NETCONF ports.
     """
-    octets = appliance_dhcp_address.split(".")
-    ssh_port = 2000 + int(octets[-1])
-    https_port = 4000 + int(octets[-1])
-    http_port = 8000 + int(octets[-1])
-    netconf_port = 3000 + int(octets[-1])
-    return {
-        "ssh_port": ssh_port,
-        "https_port": https_port,
-        "http_port": http_port,
-        "netconf_port": netconf_port,
-    }
+    last_octet = int(appliance_dhcp_address.rpartition(".")[2])
+    return {name: base + last_octet for name, base in _PORT_BASES}